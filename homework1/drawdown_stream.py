@@ -0,0 +1,246 @@
+import asyncio
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# 逐笔（tick by tick）版本的回调跟踪器
+# Q3.py 需要先下载完整历史，再用 cummax 扫描相邻新高之间的区间；
+# 这里用同样的口径（价格 >= 历史最高即为新高并重置峰值，自峰值回撤 ≥5% 记为一次回调），
+# 但每个股票只保存常数个状态变量，可以直接接在实时行情流后面使用。
+
+CORRECTION_THRESHOLD = 0.05
+CORR_COLUMNS = ["PeakDate", "PeakPrice", "TroughDate", "TroughPrice", "DrawdownPct", "DurationDays"]
+
+# 事件类型
+CORRECTION_START = "correction_start"
+NEW_TROUGH = "new_trough"
+RECOVERY = "recovery"
+
+
+class DrawdownTracker:
+    """单个股票的回调状态机，每次 update 的时间和内存开销都是 O(1)"""
+
+    __slots__ = ("symbol", "threshold", "peak_date", "peak_price",
+                 "trough_date", "trough_price", "in_correction")
+
+    def __init__(self, symbol, threshold=CORRECTION_THRESHOLD):
+        self.symbol = symbol
+        self.threshold = threshold
+        self.peak_date = None
+        self.peak_price = None
+        self.trough_date = None
+        self.trough_price = None
+        self.in_correction = False
+
+    def drawdown(self):
+        """当前区间（自最近一次新高以来）的最大回撤比例"""
+        if self.peak_price is None:
+            return 0.0
+        return (self.peak_price - self.trough_price) / self.peak_price
+
+    def _record(self):
+        # 与 Q3.py 中 results.append(...) 的字段和计算方式保持一致
+        return {
+            "PeakDate": self.peak_date,
+            "PeakPrice": self.peak_price,
+            "TroughDate": self.trough_date,
+            "TroughPrice": self.trough_price,
+            "DrawdownPct": self.drawdown() * 100,
+            "DurationDays": (self.trough_date - self.peak_date).days,
+        }
+
+    def update(self, date, price):
+        """
+        输入一个新价格，返回本次产生的事件列表（通常为空）。
+        每个事件是 (事件类型, symbol, date, 回调记录字典) 的元组。
+        """
+        # 与 Q3.py 的 dropna() 一致：无效价格直接忽略
+        if price is None or price != price:
+            return []
+
+        # 第一个价格即为第一个历史新高
+        if self.peak_price is None:
+            self._reset_peak(date, price)
+            return []
+
+        events = []
+        if price >= self.peak_price:
+            # 新高（含持平）：结束当前区间，若已构成回调则发出恢复事件
+            if self.in_correction:
+                events.append((RECOVERY, self.symbol, date, self._record()))
+            self._reset_peak(date, price)
+            return events
+
+        # 严格小于才更新波谷，保证和 idxmin() 一样取第一次出现的最低点
+        if price < self.trough_price:
+            self.trough_price = price
+            self.trough_date = date
+            if self.in_correction:
+                events.append((NEW_TROUGH, self.symbol, date, self._record()))
+            elif self.drawdown() >= self.threshold:
+                self.in_correction = True
+                events.append((CORRECTION_START, self.symbol, date, self._record()))
+        return events
+
+    def _reset_peak(self, date, price):
+        self.peak_date = date
+        self.peak_price = price
+        self.trough_date = date
+        self.trough_price = price
+        self.in_correction = False
+
+
+class MultiSymbolTracker:
+    """按 symbol 管理多个 DrawdownTracker，适合一个进程内同时跟踪上万只股票"""
+
+    def __init__(self, threshold=CORRECTION_THRESHOLD):
+        self.threshold = threshold
+        self.trackers = {}
+
+    def update(self, symbol, date, price):
+        tracker = self.trackers.get(symbol)
+        if tracker is None:
+            tracker = DrawdownTracker(symbol, self.threshold)
+            self.trackers[symbol] = tracker
+        return tracker.update(date, price)
+
+    def consume(self, ticks):
+        """消费 (symbol, date, price) 迭代器，逐个产出事件"""
+        for symbol, date, price in ticks:
+            yield from self.update(symbol, date, price)
+
+    async def aconsume(self, ticks):
+        """消费异步的 (symbol, date, price) 流，逐个产出事件"""
+        async for symbol, date, price in ticks:
+            for event in self.update(symbol, date, price):
+                yield event
+
+
+def events_to_corr_df(events):
+    """把恢复事件整理成与 Q3.py 中 corr_df 相同结构的 DataFrame"""
+    records = [record for kind, _, _, record in events if kind == RECOVERY]
+    if not records:
+        return pd.DataFrame(columns=CORR_COLUMNS)
+    return pd.DataFrame(records, columns=CORR_COLUMNS)
+
+
+def replay_series(prices, symbol="", threshold=CORRECTION_THRESHOLD):
+    """把一段历史价格 Series 逐笔回放给跟踪器，返回全部事件"""
+    tracker = MultiSymbolTracker(threshold)
+    ticks = ((symbol, date, price) for date, price in prices.items())
+    return list(tracker.consume(ticks))
+
+
+def batch_corr_df(prices, threshold=CORRECTION_THRESHOLD):
+    """
+    Q3.py 中基于 cummax 的批量算法（精简版），用于核对流式结果。
+    这是 Q3.py 步骤 4–6 的副本，修改 Q3.py 的回调口径时需要同步修改这里。
+    """
+    prices = prices.dropna()
+    high_dates = prices.index[prices == prices.cummax()].to_list()
+    results = []
+    for peak_date, next_high in zip(high_dates[:-1], high_dates[1:]):
+        peak_price = prices.at[peak_date]
+        segment = prices.loc[peak_date:next_high]
+        trough_price = segment.min()
+        trough_date = segment.idxmin()
+        drawdown_pct = (peak_price - trough_price) / peak_price
+        if drawdown_pct >= threshold:
+            results.append({
+                "PeakDate": peak_date,
+                "PeakPrice": peak_price,
+                "TroughDate": trough_date,
+                "TroughPrice": trough_price,
+                "DrawdownPct": drawdown_pct * 100,
+                "DurationDays": (trough_date - peak_date).days
+            })
+    if not results:
+        return pd.DataFrame(columns=CORR_COLUMNS)
+    return pd.DataFrame(results, columns=CORR_COLUMNS)
+
+
+def self_check():
+    """
+    离线核对（不需要下载数据）：用一段包含持平新高、缺失值和未恢复回调的
+    合成价格序列，确认流式结果与 batch_corr_df 一致，并检查事件顺序。
+    """
+    dates = pd.date_range("2024-01-01", periods=13, freq="D")
+    prices = pd.Series([100, 100, 97, 94, 93, np.nan, 95, 100, 102, 96, np.nan, 90, 95],
+                       index=dates, dtype=float)
+
+    events = replay_series(prices, "TEST")
+    stream_df = events_to_corr_df(events)
+    pd.testing.assert_frame_equal(stream_df, batch_corr_df(prices))
+
+    # 持平的 100 重置峰值，第一次回调从第二个 100 算起、到下一个 100 恢复；
+    # 102 之后的回调没有恢复，不计入 corr_df
+    assert len(stream_df) == 1
+    assert stream_df.loc[0, "PeakDate"] == dates[1]
+    assert stream_df.loc[0, "TroughDate"] == dates[4]
+    assert stream_df.loc[0, "DurationDays"] == 3
+    kinds = [(kind, date) for kind, _, date, _ in events]
+    assert kinds == [
+        (CORRECTION_START, dates[3]),
+        (NEW_TROUGH, dates[4]),
+        (RECOVERY, dates[7]),
+        (CORRECTION_START, dates[9]),
+        (NEW_TROUGH, dates[11]),
+    ], kinds
+    print("离线核对通过：流式结果与批量算法一致。")
+
+
+async def _demo_async(prices, symbol):
+    # 用异步生成器模拟实时行情推送
+    async def feed():
+        for date, price in prices.items():
+            yield symbol, date, price
+            await asyncio.sleep(0)
+
+    tracker = MultiSymbolTracker()
+    return [event async for event in tracker.aconsume(feed())]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="流式回调跟踪器：回放 ^GSPC 并与批量结果核对")
+    parser.add_argument("--offline", action="store_true", help="只运行离线的合成数据核对，不下载数据")
+    args = parser.parse_args()
+
+    self_check()
+    if args.offline:
+        exit()
+
+    import yfinance as yf
+
+    # 1. 下载与 Q3.py 相同的 ^GSPC 历史数据
+    symbol = "^GSPC"
+    start_date = "1950-01-01"
+    end_date = datetime.today().strftime("%Y-%m-%d")
+    print(f"正在下载 {symbol} 从 {start_date} 到 {end_date} 的数据...")
+    raw = yf.download(symbol, start=start_date, end=end_date, progress=False)
+    if raw.empty:
+        print("未能下载到任何数据，请检查股票代码、日期范围或网络连接。程序将退出。")
+        exit()
+    price_col = "Adj Close" if "Adj Close" in raw.columns else "Close"
+    prices = raw[(price_col, symbol)].dropna()
+
+    # 2. 逐笔回放（异步流），并与批量算法结果核对
+    events = asyncio.run(_demo_async(prices, symbol))
+    stream_df = events_to_corr_df(events)
+    batch_df = batch_corr_df(prices)
+    pd.testing.assert_frame_equal(stream_df, batch_df)
+    print(f"流式结果与批量 corr_df 一致，共 {len(stream_df)} 次回调。")
+
+    counts = pd.Series([kind for kind, *_ in events]).value_counts()
+    print("事件统计：")
+    print(counts.to_string())
+
+    # 3. 与 Q3.py 相同的时长百分位统计
+    durations = stream_df["DurationDays"].to_numpy()
+    if durations.size > 0:
+        p25, p50, p75 = np.percentile(durations, [25, 50, 75])
+        print(f"时长 25th 百分位：{int(p25)} 天")
+        print(f"中位数（50th）：{int(p50)} 天")
+        print(f"时长 75th 百分位：{int(p75)} 天")
@@ -3,6 +3,7 @@ import yfinance as yf
 import numpy as np
 import requests
 import warnings
+from feature_cache import FeatureCache
 
 # 忽略一些yfinance下载时可能出现的警告
 warnings.filterwarnings('ignore')
@@ -44,15 +45,23 @@ print("步骤 3: 正在计算各项指标...")
 df_copy = all_data.copy()
 df_copy['Date'] = pd.to_datetime(df_copy['Date'])
 
-# 计算252日增长率
-df_copy['growth_252d'] = df_copy.groupby('Ticker')['Close'].pct_change(periods=252)
+# 派生指标缓存：价格序列和参数都没变的股票直接读取上次的计算结果
+cache = FeatureCache()
+
+# 计算252日增长率和30日滚动标准差（params 中的 version 在修改公式时需递增）
+growth_series, vol_series = cache.apply_many(df_copy, [
+    ('growth_252d', {'periods': 252, 'version': 1},
+     lambda x: pd.Series(x).pct_change(periods=252).to_numpy()),
+    ('rolling_std', {'window': 30, 'version': 1},
+     lambda x: pd.Series(x).rolling(window=30).std().to_numpy()),
+])
+df_copy['growth_252d'] = growth_series
 
 # ##########################################################################
 # ### 使用题目指定的非标准波动率公式 ##################################
 # ##########################################################################
 print("注意：正在使用题目指定的非标准波动率公式...")
 # 基于收盘价本身计算滚动标准差，并年化
-vol_series = df_copy.groupby('Ticker')['Close'].rolling(window=30).std().reset_index(level=0, drop=True)
 df_copy['volatility'] = vol_series * np.sqrt(252)
 # ##########################################################################
 
@@ -60,6 +69,8 @@ df_copy['volatility'] = vol_series * np.sqrt(252)
 risk_free_rate = 0.045
 df_copy['Sharpe'] = (df_copy['growth_252d'] - risk_free_rate) / df_copy['volatility']
 print("指标计算完成。")
+cache.evict()
+cache.report()
 print("-" * 30)
 
 # --- 步骤 4: 筛选特定日期的数据并进行分析 ---
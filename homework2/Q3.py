@@ -3,6 +3,7 @@ import yfinance as yf
 import numpy as np
 import requests
 import warnings
+from feature_cache import FeatureCache
 
 # 忽略一些yfinance下载时可能出现的警告
 warnings.filterwarnings('ignore')
@@ -41,17 +42,24 @@ print("-" * 30)
 print("步骤 2: 正在计算1到12个月的未来增长率...")
 df_growth = all_data.copy().sort_values(by=['Ticker', 'Date'])
 TRADING_DAYS_PER_MONTH = 21
+# 派生指标缓存：价格序列和参数都没变的股票直接读取上次的计算结果
+cache = FeatureCache()
 
-# 使用循环为每个持有期创建新列
+# 为每个持有期准备一个指标：按股票分组，用 shift(-N) 计算未来增长率
+# （一次分组完成全部12列，每只股票只哈希一次；修改公式时需递增 version）
+specs = []
 for months in range(1, 13):
     future_days = months * TRADING_DAYS_PER_MONTH
-    col_name = f'future_growth_{months}m'
-    
-    # 使用 groupby 和 shift(-N) 计算未来增长率
-    df_growth[col_name] = df_growth.groupby('Ticker')['Close'].transform(
-        lambda x: x.shift(-future_days) / x - 1
-    )
+    specs.append((
+        'future_growth', {'days': future_days, 'version': 1},
+        lambda x, n=future_days: (pd.Series(x).shift(-n) / pd.Series(x) - 1).to_numpy()
+    ))
+
+for months, series in zip(range(1, 13), cache.apply_many(df_growth, specs)):
+    df_growth[f'future_growth_{months}m'] = series
 print("未来增长率计算完成。")
+cache.evict()
+cache.report()
 print("-" * 30)
 
 
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import time
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+# 派生指标的磁盘缓存
+# 缓存键 = 股票价格序列（日期 + 数值）的哈希 + 指标名 + 参数，
+# 因此只要某只股票的历史数据或参数没有变化，重复运行时就直接读取缓存结果。
+# 缓存目录有总大小上限，超出时按最近访问时间（LRU）淘汰最旧的文件：
+# 运行中每写入上限的 1/EVICT_EVERY_FRACTION 就自动淘汰一次，运行结束时再显式调用 evict()。
+
+DEFAULT_CACHE_DIR = ".feature_cache"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# 超过这个时间仍未被 os.replace 的临时文件视为崩溃残留，淘汰时一并删除
+STALE_TMP_SECONDS = 3600
+# 自上次淘汰以来新写入的字节数超过 max_bytes / EVICT_EVERY_FRACTION 时自动淘汰
+EVICT_EVERY_FRACTION = 10
+
+
+def series_digest(dates, values):
+    """计算价格序列内容的哈希（同时包含日期和价格）"""
+    h = hashlib.sha256()
+    h.update(np.asarray(pd.to_datetime(dates).values, dtype="datetime64[ns]").tobytes())
+    h.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    return h.hexdigest()
+
+
+class FeatureCache:
+    """按内容寻址的派生指标缓存，带大小上限和 LRU 淘汰"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self.evicted = 0
+        self._written_since_evict = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _key(self, digest, name, params):
+        payload = json.dumps({"series": digest, "name": name, "params": params}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def get_or_compute(self, dates, values, name, params, func, digest=None):
+        """
+        读取缓存的指标数组；未命中时调用 func(values) 计算并写入缓存。
+        func 需要返回与 values 等长的一维数组；params 中应带上公式版本号，
+        修改计算公式时同步递增，旧结果就不会再被命中。
+        digest 可传入已算好的 series_digest，避免同一序列重复哈希。
+        """
+        if digest is None:
+            digest = series_digest(dates, values)
+        path = self._path(self._key(digest, name, params))
+        if os.path.exists(path):
+            try:
+                result = np.load(path, allow_pickle=False)
+                # 更新访问时间，用于 LRU 淘汰
+                os.utime(path)
+                self.hits[name] += 1
+                return result
+            except (OSError, ValueError):
+                # 文件损坏或被并发淘汰时当作未命中处理
+                pass
+
+        self.misses[name] += 1
+        result = np.asarray(func(values), dtype=np.float64)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, result, allow_pickle=False)
+        os.replace(tmp_path, path)
+
+        # 运行中也保证大小上限：写入量累积到一定程度就淘汰一次
+        self._written_since_evict += os.path.getsize(path)
+        if self._written_since_evict > self.max_bytes // EVICT_EVERY_FRACTION:
+            self.evict()
+        return result
+
+    def apply_many(self, df, specs, value_col="Close", group_col="Ticker", date_col="Date"):
+        """
+        一次分组处理多个指标，specs 为 (name, params, func) 列表。
+        每只股票的价格序列只哈希一次，返回与 specs 顺序一致的 Series 列表。
+        """
+        outs = [pd.Series(np.nan, index=df.index, dtype=np.float64) for _ in specs]
+        for _, grp in df.groupby(group_col, sort=False):
+            dates = grp[date_col].to_numpy()
+            values = grp[value_col].to_numpy(dtype=np.float64)
+            digest = series_digest(dates, values)
+            for out, (name, params, func) in zip(outs, specs):
+                out.loc[grp.index] = self.get_or_compute(dates, values, name, params, func, digest)
+        return outs
+
+    def evict(self):
+        """按最近访问时间从旧到新删除缓存文件，直到总大小不超过上限；返回本次删除的文件数"""
+        self._written_since_evict = 0
+        entries = []
+        now = time.time()
+        for entry in os.scandir(self.cache_dir):
+            # 清理崩溃运行留下的临时文件（保留可能仍在写入的较新文件）
+            if entry.is_file() and entry.name.endswith(".tmp"):
+                if now - entry.stat().st_mtime > STALE_TMP_SECONDS:
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+                continue
+            if entry.is_file() and entry.name.endswith(".npy"):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        self.evicted += removed
+        return removed
+
+    def summary(self):
+        """返回每个指标的命中/未命中次数和命中率"""
+        rows = []
+        for name in sorted(set(self.hits) | set(self.misses)):
+            hits, misses = self.hits[name], self.misses[name]
+            rows.append({"indicator": name, "hits": hits, "misses": misses,
+                         "hit_rate": hits / (hits + misses)})
+        return pd.DataFrame(rows, columns=["indicator", "hits", "misses", "hit_rate"])
+
+    def report(self):
+        """打印缓存命中率和本次运行累计淘汰的文件数"""
+        summary = self.summary()
+        total_hits, total_misses = summary["hits"].sum(), summary["misses"].sum()
+        print("派生指标缓存统计:")
+        if summary.empty:
+            print("  本次运行没有使用缓存。")
+        else:
+            print(summary.to_string(index=False, formatters={"hit_rate": "{:.1%}".format}))
+            overall = total_hits / (total_hits + total_misses)
+            print(f"  总命中率: {overall:.1%}（命中 {total_hits}，重新计算 {total_misses}）")
+        if self.evicted:
+            print(f"  超出缓存上限，已按 LRU 淘汰 {self.evicted} 个文件。")
@@ -0,0 +1,209 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+# Q4.py 的组合级回测版本
+# Q4.py 把每一条 rsi < 25 的记录都当作独立的 $1,000 交易并直接求和，
+# 忽略了持仓重叠、资金上限以及同一股票连续多天重复买入。
+# 这里按交易日逐日推进，每天只对"当天所有股票"组成的数组做向量运算：
+#   - 同时持仓数不超过 max_positions；
+#   - 每只股票同一时间最多一个持仓，平仓后 cooldown_days 个交易日内不再买入；
+#   - 每笔投入 stake 美元，现金不足时不再开仓；
+#   - 持有该股票自己的 hold_days 个交易日（按它自己的行数，而不是所有股票日期的并集）
+#     后按 growth_future_{hold_days}d 兑现收益；之后没有 hold_days 行数据的股票不开仓；
+#     持有期超出回测区间末尾的交易，在最后一个交易日按最后可用收盘价平仓。
+# 输出每日权益曲线（持仓按 Close 逐日盯市）、换手率和最大回撤。
+# 数据中没有 Close 列时退化为按成本计价，此时回撤只反映已实现盈亏，
+# 且不会开出持有期超出数据末尾的交易。
+
+RSI_THRESHOLD = 25
+START_DATE = '2000-01-01'
+END_DATE = '2025-06-01'
+HOLD_DAYS = 30
+
+
+def growth_column(hold_days):
+    """持有期对应的未来收益列名"""
+    return f'growth_future_{hold_days}d'
+
+
+def to_panels(df, hold_days=HOLD_DAYS, start=START_DATE, end=END_DATE):
+    """
+    把长表转换成 (交易日 × 股票) 的 rsi、未来收益、平仓日下标和收盘价矩阵。
+    平仓日是该股票自己往后第 hold_days 行的日期在交易日序列中的下标，
+    与 growth_future_{N}d 的计算口径一致；超出回测区间末尾时为 len(dates)，
+    股票之后没有足够的行时为 -1。
+    收盘价矩阵按股票向前填充，缺少 Close 列时返回 None。
+    """
+    growth_col = growth_column(hold_days)
+    if growth_col not in df.columns:
+        raise ValueError(f"数据中没有 {growth_col} 列，无法按 {hold_days} 个交易日持有")
+    # 先在完整数据上按股票自己的行数找平仓日期，再截取回测区间
+    df = df.sort_values(['Ticker', 'date'])
+    df = df.assign(exit_date=df.groupby('Ticker')['date'].shift(-hold_days))
+    df = df[(df['date'] >= start) & (df['date'] <= end)]
+    rsi = df.pivot_table(index='date', columns='Ticker', values='rsi', aggfunc='last')
+    growth = df.pivot_table(index='date', columns='Ticker', values=growth_col, aggfunc='last')
+    growth = growth.reindex(index=rsi.index, columns=rsi.columns)
+
+    exit_date = df.pivot_table(index='date', columns='Ticker', values='exit_date', aggfunc='last')
+    exit_date = exit_date.reindex(index=rsi.index, columns=rsi.columns).to_numpy(dtype='datetime64[ns]')
+    exit_idx = np.searchsorted(rsi.index.to_numpy(dtype='datetime64[ns]'), exit_date).astype(np.int64)
+    exit_idx[np.isnat(exit_date)] = -1
+    close = None
+    if 'Close' in df.columns:
+        close = df.pivot_table(index='date', columns='Ticker', values='Close', aggfunc='last')
+        close = close.reindex(index=rsi.index, columns=rsi.columns).ffill().to_numpy(dtype=np.float64)
+    return (rsi.index, rsi.columns, rsi.to_numpy(dtype=np.float64),
+            growth.to_numpy(dtype=np.float64), exit_idx, close)
+
+
+def run_backtest(dates, rsi, growth, exit_idx, close=None, capital=100_000.0, stake=1_000.0,
+                 max_positions=50, cooldown_days=5, rsi_threshold=RSI_THRESHOLD):
+    """
+    逐日向量化回测。rsi / growth / exit_idx / close 为 (交易日 × 股票) 的二维数组，
+    growth 为持有期的未来收益（价格比值），exit_idx 为 to_panels 给出的平仓日下标。
+    返回每日的 DataFrame（现金、持仓市值、权益、持仓数、开/平仓数、平仓回款、回撤），
+    result.attrs['mark_to_market'] 标记持仓是否按收盘价盯市。
+    """
+    n_days, n_tickers = rsi.shape
+    last_day = n_days - 1
+    cash = float(capital)
+    exit_day = np.full(n_tickers, -1, dtype=np.int64)        # 持仓的平仓日下标，-1 表示空仓
+    exit_ratio = np.zeros(n_tickers, dtype=np.float64)       # 平仓时的价格比值
+    entry_close = np.ones(n_tickers, dtype=np.float64)       # 开仓当天的收盘价
+    next_allowed = np.zeros(n_tickers, dtype=np.int64)       # 冷却期结束后的第一个可买入日
+    n_open = 0
+
+    out_cash = np.empty(n_days)
+    out_invested = np.empty(n_days)
+    out_open = np.empty(n_days, dtype=np.int64)
+    out_entries = np.empty(n_days, dtype=np.int64)
+    out_exits = np.empty(n_days, dtype=np.int64)
+    out_proceeds = np.zeros(n_days)
+
+    for t in range(n_days):
+        # 1. 先平仓：到期的持仓按开仓时确定的价格比值兑现
+        closing = exit_day == t
+        n_close = int(closing.sum())
+        if n_close:
+            out_proceeds[t] = stake * exit_ratio[closing].sum()
+            cash += out_proceeds[t]
+            exit_day[closing] = -1
+            next_allowed[closing] = t + cooldown_days + 1
+            n_open -= n_close
+
+        # 2. 再开仓：信号成立、空仓、过了冷却期、且能估值的股票
+        #    （持有期在区间内时需要未来收益数据，超出区间末尾时需要收盘价；
+        #     没有收盘价时无法给提前结束的交易估值，只开持有期完整的仓位）
+        n_new = 0
+        slots = min(max_positions - n_open, int(cash // stake))
+        if slots > 0 and t < last_day:
+            row = rsi[t]
+            exits = exit_idx[t]
+            full_hold = (exits > t) & (exits <= last_day) & ~np.isnan(growth[t])
+            valuable = full_hold
+            if close is not None:
+                valuable = full_hold | ((exits > last_day) & ~np.isnan(close[t]))
+            mask = (row < rsi_threshold) & (exit_day < 0) & (next_allowed <= t) & valuable
+            candidates = np.flatnonzero(mask)
+            if candidates.size > slots:
+                # 名额不够时优先买入 RSI 最低（超卖最严重）的股票
+                candidates = candidates[np.argpartition(row[candidates], slots - 1)[:slots]]
+            n_new = candidates.size
+            if n_new:
+                full = full_hold[candidates]
+                exit_day[candidates] = np.where(full, exits[candidates], last_day)
+                if close is None:
+                    exit_ratio[candidates] = growth[t, candidates]
+                else:
+                    # 持有期超出区间末尾：在最后一个交易日按最后可用收盘价平仓
+                    exit_ratio[candidates] = np.where(
+                        full, growth[t, candidates], close[last_day, candidates] / close[t, candidates])
+                    entry_close[candidates] = close[t, candidates]
+                cash -= stake * n_new
+                n_open += n_new
+
+        out_cash[t] = cash
+        if close is not None and n_open:
+            held = exit_day >= 0
+            out_invested[t] = stake * (close[t, held] / entry_close[held]).sum()
+        else:
+            out_invested[t] = stake * n_open
+        out_open[t] = n_open
+        out_entries[t] = n_new
+        out_exits[t] = n_close
+
+    result = pd.DataFrame({
+        'cash': out_cash,
+        'invested': out_invested,
+        'equity': out_cash + out_invested,
+        'open_positions': out_open,
+        'entries': out_entries,
+        'exits': out_exits,
+        'exit_proceeds': out_proceeds,
+    }, index=pd.Index(dates, name='date'))
+    result['drawdown'] = result['equity'] / result['equity'].cummax() - 1
+    result.attrs['mark_to_market'] = close is not None
+    return result
+
+
+def summarize(result, capital=100_000.0, stake=1_000.0):
+    """汇总回测结果：净收入、交易次数、年化换手率和最大回撤"""
+    equity = result['equity']
+    years = max((result.index[-1] - result.index[0]).days / 365.25, 1 / 365.25)
+    # 单边换手：买入与卖出金额的平均值 / 平均权益（卖出按实际平仓回款计）
+    traded = (stake * result['entries'].sum() + result['exit_proceeds'].sum()) / 2
+    return {
+        'final_equity': equity.iloc[-1],
+        'net_income': equity.iloc[-1] - capital,
+        'trades': int(result['entries'].sum()),
+        'max_open_positions': int(result['open_positions'].max()),
+        'annual_turnover': traded / equity.mean() / years,
+        'max_drawdown': result['drawdown'].min(),
+        'mark_to_market': result.attrs.get('mark_to_market', False),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RSI 策略的组合级回测")
+    parser.add_argument("--data", default="data.parquet", help="Q4.py 下载的 Parquet 数据")
+    parser.add_argument("--capital", type=float, default=100_000.0, help="初始资金（美元）")
+    parser.add_argument("--stake", type=float, default=1_000.0, help="每笔投入（美元）")
+    parser.add_argument("--max-positions", type=int, default=50, help="最大同时持仓数")
+    parser.add_argument("--cooldown", type=int, default=5, help="平仓后同一股票的冷却交易日数")
+    parser.add_argument("--hold", type=int, default=HOLD_DAYS,
+                        help="持有交易日数，数据中需有对应的 growth_future_{N}d 列")
+    args = parser.parse_args()
+
+    # 只读取需要的列；Close 用于逐日盯市，缺失时退化为按成本计价
+    available = set(pq.read_schema(args.data).names)
+    growth_col = growth_column(args.hold)
+    if growth_col not in available:
+        parser.error(f"数据中没有 {growth_col} 列，--hold 只能取已有的 growth_future_{{N}}d 持有期")
+    columns = ['Ticker', 'Date', 'rsi', growth_col] + (['Close'] if 'Close' in available else [])
+    df = pd.read_parquet(args.data, engine="pyarrow", columns=columns)
+    df['date'] = pd.to_datetime(df['Date'])
+    dates, tickers, rsi, growth, exit_idx, close = to_panels(df, hold_days=args.hold)
+    print(f"--> 数据加载完成：{len(dates)} 个交易日 × {len(tickers)} 只股票。")
+    if close is None:
+        print("--> 注意：数据中没有 Close 列，持仓按成本计价，回撤只反映已实现盈亏。")
+
+    result = run_backtest(dates, rsi, growth, exit_idx, close, capital=args.capital, stake=args.stake,
+                          max_positions=args.max_positions, cooldown_days=args.cooldown)
+    stats = summarize(result, capital=args.capital, stake=args.stake)
+
+    # 与 Q4.py 的"每条信号独立交易"口径对比
+    naive = df[(df['rsi'] < RSI_THRESHOLD) & (df['date'] >= START_DATE) & (df['date'] <= END_DATE)]
+    naive_income = args.stake * (naive[growth_col] - 1).sum()
+
+    print("\n--- 组合回测结果 ---")
+    print(f"交易次数: {stats['trades']}（Q4.py 口径为 {len(naive)} 次）")
+    print(f"最大同时持仓: {stats['max_open_positions']}")
+    print(f"期末权益: ${stats['final_equity']:,.2f}")
+    print(f"净收入: ${stats['net_income']:,.2f}（Q4.py 口径为 ${naive_income:,.2f}）")
+    print(f"年化换手率: {stats['annual_turnover']:.2f}")
+    drawdown_label = "最大回撤" if stats['mark_to_market'] else "最大回撤（仅已实现盈亏）"
+    print(f"{drawdown_label}: {stats['max_drawdown']:.2%}")
@@ -0,0 +1,230 @@
+import argparse
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Q2.py 的核外（out-of-core）版本
+# Q2.py 需要把 yf.download 的结果和堆叠后的长表整体放进内存；
+# 全市场几万只股票、几十年的数据放不下时，改为：
+#   1. 从磁盘上的长表 Parquet（Date, Ticker, Close）只读 Ticker 列统计每只股票的行数；
+#   2. 把总内存预算平均分给各个进程，按每块的预算把股票切分成若干块，
+#      同一只股票只会落在一个块里；
+#   3. 流式扫描一遍输入，把每块的数据写到各自的暂存文件（<output>_staging/chunk=N/）；
+#   4. 多进程并行地逐块读取自己的暂存文件、计算 growth_252d / volatility / Sharpe；
+#   5. 每块算完立即分批写入分区 Parquet（chunk=00000/part-0.parquet ...），最后删除暂存目录。
+# 每个进程的峰值内存按实测的 WORKER_OVERHEAD_MB + 行数 × BYTES_PER_ROW 估算，
+# 所以全部进程合计不超过总预算（单只股票的数据超过每块预算时除外）。
+# 预算不含解释器和 pandas/pyarrow 导入后的常驻内存（实测约 115 MB/进程）。
+# 滚动指标只依赖单只股票自己的历史，所以分块计算与整表一次性调用
+# compute_metrics 的结果完全一致（可用 --verify 核对）。
+
+RISK_FREE_RATE = 0.045
+GROWTH_PERIODS = 252
+VOL_WINDOW = 30
+# 在新进程中单独运行 process_chunk（4 万到 200 万行），峰值 RSS 增量约为
+# 45 MB 固定开销（Arrow/pandas 首次使用时的初始化）+ 每行 103 字节
+# （读取、排序副本、groupby-rolling 的 MultiIndex 结果和三个结果列），下面两个值都留出了余量。
+WORKER_OVERHEAD_MB = 64
+BYTES_PER_ROW = 140
+# 每块至少要能放下的数据量，预算太小时减少进程数而不是把块切得过碎
+MIN_CHUNK_MB = 16
+# 写出结果时每批转换成 Arrow 的行数，避免整块结果再复制一份
+WRITE_BATCH_ROWS = 100_000
+
+
+def compute_metrics(df, risk_free_rate=RISK_FREE_RATE):
+    """按 Q2.py 步骤 3 的公式计算指标（未经过 feature_cache），df 为 Date/Ticker/Close 长表"""
+    df = df.sort_values(['Ticker', 'Date']).reset_index(drop=True)
+    df['growth_252d'] = df.groupby('Ticker', observed=True)['Close'].pct_change(periods=GROWTH_PERIODS)
+    vol_series = df.groupby('Ticker', observed=True)['Close'].rolling(window=VOL_WINDOW).std().reset_index(level=0, drop=True)
+    df['volatility'] = vol_series * np.sqrt(252)
+    del vol_series
+    df['Sharpe'] = (df['growth_252d'] - risk_free_rate) / df['volatility']
+    return df
+
+
+def plan_chunks(input_path, chunk_bytes):
+    """只扫描 Ticker 列统计行数，再按内存预算把股票贪心地分组"""
+    dataset = ds.dataset(input_path, format="parquet", partitioning="hive")
+    counts = {}
+    for batch in dataset.to_batches(columns=['Ticker']):
+        for item in pc.value_counts(batch.column(0)).to_pylist():
+            if item['values'] is None:
+                continue
+            counts[item['values']] = counts.get(item['values'], 0) + item['counts']
+
+    max_rows = max(1, chunk_bytes // BYTES_PER_ROW)
+    chunks, current, current_rows = [], [], 0
+    for ticker in sorted(counts):
+        rows = counts[ticker]
+        # 单只股票超过预算时也只能独占一块
+        if current and current_rows + rows > max_rows:
+            chunks.append(current)
+            current, current_rows = [], 0
+        current.append(ticker)
+        current_rows += rows
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def split_input(input_path, staging_path, chunks):
+    """流式扫描一遍输入，按规划好的块号把数据写入 staging_path/chunk=N/"""
+    tickers = pa.array([ticker for chunk in chunks for ticker in chunk], type=pa.string())
+    chunk_ids = pa.array([i for i, chunk in enumerate(chunks) for _ in chunk], type=pa.int32())
+    dataset = ds.dataset(input_path, format="parquet", partitioning="hive")
+    schema = pa.schema([
+        ('Date', dataset.schema.field('Date').type),
+        ('Ticker', pa.string()),
+        ('Close', pa.float64()),
+        ('chunk', pa.int32()),
+    ])
+
+    def batches():
+        for batch in dataset.to_batches(columns=['Date', 'Ticker', 'Close']):
+            # 分区列可能以字典类型读入，统一成字符串；Ticker 为空的行不属于任何块
+            ticker = pc.cast(batch.column(1), pa.string())
+            valid = pc.is_valid(ticker)
+            ticker = ticker.filter(valid)
+            chunk = pc.take(chunk_ids, pc.index_in(ticker, value_set=tickers))
+            yield pa.RecordBatch.from_arrays(
+                [batch.column(0).filter(valid), ticker,
+                 pc.cast(batch.column(2).filter(valid), pa.float64()), chunk],
+                schema=schema)
+
+    ds.write_dataset(batches(), staging_path, schema=schema, format="parquet",
+                     partitioning=ds.partitioning(pa.schema([('chunk', pa.int32())]), flavor="hive"),
+                     existing_data_behavior="delete_matching")
+
+
+def load_chunk(staging_path, chunk_id):
+    """读取一块的暂存数据；Date 与 Q2.py 一样统一转换成时间戳"""
+    table = pq.read_table(os.path.join(staging_path, f"chunk={chunk_id}"))
+    # 字符串日期先在 Arrow 中解析，避免在 pandas 中生成逐行的字符串对象；
+    # Arrow 无法解析的格式留给下面的 pd.to_datetime 处理
+    date_idx = table.schema.get_field_index('Date')
+    if pa.types.is_string(table.schema.field(date_idx).type):
+        try:
+            table = table.set_column(date_idx, 'Date', pc.cast(table.column(date_idx), pa.timestamp('ns')))
+        except pa.ArrowInvalid:
+            pass
+    # self_destruct 让 Arrow 缓冲区在转换过程中逐列释放，避免同时保留两份数据；
+    # Ticker 读成分类类型，省去每行一个 Python 字符串对象
+    df = table.to_pandas(split_blocks=True, self_destruct=True, strings_to_categorical=True)
+    del table
+    # 把 Parquet 解码时的临时缓冲区还给操作系统，否则会一直计入进程内存
+    pa.default_memory_pool().release_unused()
+    df['Date'] = pd.to_datetime(df['Date'])
+    return df
+
+
+def process_chunk(staging_path, output_path, chunk_id, n_tickers, risk_free_rate=RISK_FREE_RATE):
+    """读取一块股票的暂存数据，计算指标并写入 output_path/chunk=XXXXX/"""
+    df = compute_metrics(load_chunk(staging_path, chunk_id), risk_free_rate)
+
+    chunk_dir = os.path.join(output_path, f"chunk={chunk_id:05d}")
+    os.makedirs(chunk_dir, exist_ok=True)
+    schema = pa.Schema.from_pandas(df.iloc[:0], preserve_index=False)
+    # 分类类型的 Ticker 按字符串写出，保证各块文件的 schema 一致
+    schema = schema.set(schema.get_field_index('Ticker'), pa.field('Ticker', pa.string()))
+    with pq.ParquetWriter(os.path.join(chunk_dir, "part-0.parquet"), schema) as writer:
+        for start in range(0, len(df), WRITE_BATCH_ROWS):
+            batch = df.iloc[start:start + WRITE_BATCH_ROWS]
+            writer.write_table(pa.Table.from_pandas(batch, schema=schema, preserve_index=False))
+    return chunk_id, n_tickers, len(df)
+
+
+def run_out_of_core(input_path, output_path, memory_mb=1024, workers=None, risk_free_rate=RISK_FREE_RATE):
+    """
+    按块并行计算全部股票的指标，结果增量写入分区 Parquet。
+    memory_mb 是所有进程合计的内存预算，每个进程同一时间只处理一块，
+    所以每块的数据预算为 memory_mb / workers - WORKER_OVERHEAD_MB；
+    预算不够时自动减少进程数。
+    """
+    if memory_mb < WORKER_OVERHEAD_MB + MIN_CHUNK_MB:
+        raise ValueError(f"内存预算至少需要 {WORKER_OVERHEAD_MB + MIN_CHUNK_MB} MB")
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, int(memory_mb // (WORKER_OVERHEAD_MB + MIN_CHUNK_MB)))
+    chunk_mb = memory_mb / workers - WORKER_OVERHEAD_MB
+    chunks = plan_chunks(input_path, int(chunk_mb * 1024 * 1024))
+    print(f"共 {sum(len(c) for c in chunks)} 只股票，切分为 {len(chunks)} 块"
+          f"（总预算 {memory_mb} MB，{workers} 个进程，每块数据 {chunk_mb:.0f} MB）。")
+
+    staging_path = output_path.rstrip("/\\") + "_staging"
+    shutil.rmtree(staging_path, ignore_errors=True)
+    split_input(input_path, staging_path, chunks)
+    print(f"输入已按块拆分到 {staging_path}。")
+
+    # 清理上一次运行留下的分区，避免块数变少时读到过期结果
+    if os.path.isdir(output_path):
+        for name in os.listdir(output_path):
+            stale = os.path.join(output_path, name, "part-0.parquet")
+            if name.startswith("chunk=") and os.path.exists(stale):
+                os.remove(stale)
+    os.makedirs(output_path, exist_ok=True)
+    total_rows = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(process_chunk, staging_path, output_path, i, len(tickers), risk_free_rate)
+                       for i, tickers in enumerate(chunks)]
+            for done, future in enumerate(as_completed(futures), start=1):
+                chunk_id, n_tickers, n_rows = future.result()
+                total_rows += n_rows
+                print(f"  [{done}/{len(chunks)}] chunk={chunk_id:05d}: {n_tickers} 只股票，{n_rows} 行")
+    finally:
+        shutil.rmtree(staging_path, ignore_errors=True)
+    print(f"计算完成，共写入 {total_rows} 行到 {output_path}。")
+    return total_rows
+
+
+def read_results(output_path, date=None):
+    """读取结果；指定 date 时只加载当天的数据（结果中的 Date 总是时间戳类型）"""
+    dataset = ds.dataset(output_path, format="parquet", partitioning="hive")
+    filter_expr = None
+    if date is not None:
+        filter_expr = pc.field('Date') == pa.scalar(pd.Timestamp(date), type=dataset.schema.field('Date').type)
+    return dataset.to_table(filter=filter_expr).to_pandas()
+
+
+def verify(input_path, output_path, risk_free_rate=RISK_FREE_RATE):
+    """
+    把分块结果与整表一次性调用 compute_metrics 的结果逐行比较（仅适用于能放进内存的数据集）。
+    这里验证的是分块不丢失精度，并不等同于与 Q2.py（经 feature_cache 计算）逐行核对。
+    """
+    expected = pd.read_parquet(input_path, columns=['Date', 'Ticker', 'Close'])
+    expected['Ticker'] = expected['Ticker'].astype(str)
+    expected['Date'] = pd.to_datetime(expected['Date'])
+    expected = compute_metrics(expected, risk_free_rate)
+    actual = read_results(output_path).drop(columns=['chunk'])
+    actual['Ticker'] = actual['Ticker'].astype(str)
+    actual = actual.sort_values(['Ticker', 'Date']).reset_index(drop=True)
+    pd.testing.assert_frame_equal(actual, expected[actual.columns], check_exact=True)
+    print("核对通过：分块结果与整表计算完全一致。")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="分块计算 growth_252d / volatility / Sharpe")
+    parser.add_argument("input", help="长表 Parquet 文件或目录，需包含 Date, Ticker, Close 列")
+    parser.add_argument("output", help="结果输出目录（按 chunk 分区）")
+    parser.add_argument("--memory-mb", type=int, default=1024, help="所有进程合计的内存预算（MB）")
+    parser.add_argument("--workers", type=int, default=None, help="并行进程数，默认使用全部 CPU（预算在进程间平分，不够时自动减少）")
+    parser.add_argument("--date", default="2025-06-06", help="输出该日期的中位数夏普比率")
+    parser.add_argument("--verify", action="store_true", help="与整表一次性计算的结果逐行核对")
+    args = parser.parse_args()
+
+    run_out_of_core(args.input, args.output, args.memory_mb, args.workers)
+    if args.verify:
+        verify(args.input, args.output)
+
+    results_df = read_results(args.output, args.date)
+    results_df.dropna(subset=['growth_252d', 'Sharpe'], inplace=True)
+    print(f"在 {args.date}，共有 {len(results_df)} 只股票有完整的 growth_252d 和 Sharpe 数据。")
+    if not results_df.empty:
+        print(f"中位数夏普比率为: {results_df['Sharpe'].median():.4f}")